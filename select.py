@@ -1,8 +1,88 @@
 import argparse
+import concurrent.futures
 import csv
+import errno
 import os
 import shutil
 import sys
+import tarfile
+
+COPY_THREADS = 32       # Default number of copies in flight at once
+COPY_BATCH = 256        # Copies submitted before we wait for them
+ARCHIVE_BUFFER = 1<<20  # Bytes copied at a time into an archive
+
+
+def drop_cached(fd: int):
+    '''
+    Ask the kernel to discard the cached pages of an open file. Dirty
+    pages can't be dropped so write them out first.
+    '''
+    if hasattr(os, 'posix_fadvise'):
+        os.fdatasync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def copy_file(source: str, target: str, uncached: bool=False):
+    '''
+    Copy the file at source to target without staging the data through
+    our own buffers. copy_file_range lets the kernel do the copy and
+    allows a copy-on-write filesystem to share the blocks. Where it isn't
+    available, shutil.copyfile will use sendfile on Linux.
+
+    If uncached is set, neither file is left occupying the page cache.
+
+    Returns False if the source has disappeared.
+    '''
+    try:
+        src = open(source, 'rb')
+    except FileNotFoundError:
+        # The image has been deleted since the metadata was saved
+        return False
+
+    with src:
+        copied = False
+        if hasattr(os, 'copy_file_range'):
+            with open(target, 'wb') as dst:
+                size = os.fstat(src.fileno()).st_size
+                done = 0
+                try:
+                    while done < size:
+                        count = os.copy_file_range(src.fileno(), dst.fileno(), size - done)
+                        if count == 0: break
+                        done += count
+                    # Some filesystems report nothing to copy rather than
+                    # refusing, and the source may have shrunk - don't
+                    # pass off a short copy as a good one
+                    copied = done >= size
+                except OSError as e:
+                    # Older kernels and some filesystems refuse the call before
+                    # doing anything - anything else is a real error
+                    if done or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                        raise
+
+        if not copied:
+            shutil.copyfile(source, target)
+
+        if uncached:
+            drop_cached(src.fileno())
+            with open(target, 'rb+') as dst:
+                drop_cached(dst.fileno())
+
+    return True
+
+
+def up_to_date(source: os.DirEntry, target: str) -> bool:
+    '''
+    Is target a copy of source made since source last changed? Rerunning
+    a selection then only copies the images that are new or altered.
+    '''
+    try:
+        copy = os.stat(target)
+    except FileNotFoundError:
+        return False
+
+    original = source.stat()
+    return copy.st_size == original.st_size and copy.st_mtime_ns >= original.st_mtime_ns
 
 
 if __name__ == '__main__':
@@ -11,8 +91,11 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description  = 'Copy selected images to a new folder',
     )
-    parser.add_argument('--rating', type=int, help='Minimum rating')
+    parser.add_argument('--rating', type=int, default=0, help='Minimum rating')
     parser.add_argument('--log', action='store_true', help='Display selected files')
+    parser.add_argument('--archive', action='store_true', help='Write the selections to a single tar file')
+    parser.add_argument('--direct', action='store_true', help='Don\'t leave copied images in the page cache')
+    parser.add_argument('--jobs', type=int, default=COPY_THREADS, help='Number of copies to run at once')
 
     parser.add_argument('source', help='Path to hot folder')
     parser.add_argument('destination', help='Path to selections folder')
@@ -23,32 +106,76 @@ if __name__ == '__main__':
         print(f'ratings file {ratings_file} is missng', file=sys.stderr)
 
     else:
-        directory_checked = False
-
+        # Collect everything we are going to copy before touching the
+        # destination so the copies can be issued as one batch. Apply the
+        # rating filter to the whole file in one pass; most rows are
+        # rejected here and only the names of the others are kept
+        minimum = args.rating
+        basename = os.path.basename
         with open(ratings_file, 'r', newline='') as ratings:
-            reader = csv.reader(ratings)
-
-            for path, rating, nl  in reader:
-
-                # Don't copy inferior images
-                if int(rating) < args.rating: continue
-
-                # Construct the path based on its current position, not that
-                # in the metadata
-                path = os.path.join(args.source, os.path.basename(path))
-
-                # Ignore images that have been deleted since the metadata was saved
-                if not os.path.isfile(path): continue
-
-                # Make sure the target directory exists
-                if not directory_checked and not os.path.isdir(args.destination):
-                    if args.log: print(f'creating destination folder {args.destination}', file=sys.stderr)
-                    os.makedirs(args.destination)
-                    directory_checked = True
-
-                name = os.path.basename(path)
-                target = os.path.join(args.destination, name)
-
-                if args.log: print(f' copying {name} to {target}')
-                shutil.copyfile(path, target)
-
+            names = [basename(path) for path, rating, nl in csv.reader(ratings) if int(rating) >= minimum]
+
+        # Read the hot folder once to find the images still present rather
+        # than probing for each one. The directory entries usually know
+        # their own type so this needs no stat calls
+        with os.scandir(args.source) as entries:
+            present = {entry.name: entry for entry in entries if entry.is_file()}
+
+        # The destination folder is constant so build the targets by
+        # concatenation
+        destination_prefix = os.path.join(args.destination, '')
+
+        # Construct the path based on its current position, not that in the
+        # metadata, ignoring images that have been deleted since the
+        # metadata was saved
+        selected = [(present[name].path, name, destination_prefix + name) for name in names if name in present]
+
+        if args.archive:
+            # Stream everything into one file rather than creating a file
+            # per image
+            archive = args.destination.rstrip(os.sep) + '.tar'
+            if selected:
+                if args.log: print(f'creating archive {archive}', file=sys.stderr)
+                # Store the images that symlinks point to, as copying them
+                # to a folder would, rather than the links themselves
+                with tarfile.open(archive, 'w', format=tarfile.PAX_FORMAT, dereference=True, copybufsize=ARCHIVE_BUFFER) as tar:
+                    for path, name, target in selected:
+                        try:
+                            tar.add(path, arcname=name, recursive=False)
+                        except FileNotFoundError:
+                            continue
+                        if args.log: print(f' added {name} to {archive}')
+
+        else:
+            # Make sure the target directory exists
+            if selected:
+                if args.log and not os.path.isdir(args.destination):
+                    print(f'creating destination folder {args.destination}', file=sys.stderr)
+                os.makedirs(args.destination, exist_ok=True)
+
+            # The copies spend their time waiting for the disk so keep plenty
+            # of them in flight, collecting the results now and then so that
+            # any failure is reported promptly. The log is written a batch
+            # at a time as well
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+                log = []
+
+                def collect(pending):
+                    for name, target, copy in pending:
+                        if copy.result() and args.log: log.append(f' copied {name} to {target}\n')
+                    if log:
+                        sys.stdout.write(''.join(log))
+                        log.clear()
+
+                pending = []
+                for path, name, target in selected:
+                    if up_to_date(present[name], target):
+                        if args.log: log.append(f' {target} is up to date\n')
+                        continue
+                    pending.append((name, target, pool.submit(copy_file, path, target, args.direct)))
+
+                    if len(pending) >= COPY_BATCH:
+                        collect(pending)
+                        pending = []
+
+                collect(pending)
@@ -1,16 +1,20 @@
 import argparse
+import bisect
+import collections
+import concurrent.futures
 import csv
 import datetime
-import fractions
+import heapq
+import math
 import os
 import random
-import statistics
 import sys
 import textwrap
+import time
 import tkinter
 from tkinter import font as tkFont
 import tkinter.simpledialog
-from typing import List
+from typing import Dict, List
 
 import PIL
 from PIL import Image, ImageTk, ExifTags, ImageOps
@@ -25,6 +29,71 @@ from PIL import Image, ImageTk, ExifTags, ImageOps
 #    Copyright © 2010-2022 by Alex Clark and contributors
 
 BGCOLOUR='#404040'
+DECODE_POLL=10          # Milliseconds between checks for a finished decode
+DECODE_CACHE=8          # Number of decoded images to keep
+DECODE_BUDGET=256<<20   # Bytes of decoded images to keep
+METADATA_DELAY=2000     # Milliseconds before changed ratings are saved
+EXIF_CACHE=512          # Number of images whose EXIF info we keep
+TREEWALK_THREADS=8      # Folders read at once when scanning a tree
+SLIDESHOW_TICK=250      # Milliseconds per slideshow tick
+HISTOGRAM_STEP=4        # Pixels between the samples for the histogram
+HISTOGRAM_DELAY=150     # Milliseconds an image is shown before its histogram
+SETTLE_TIME=1.0         # Seconds a new image must be unchanged before we show it
+MTIME_GRANULE=2.0       # Seconds within which a folder's mtime may not change
+
+# The EXIF tags we display, mapped to user-friendly labels. These are
+# built once rather than each time an image is shown
+EXIF_NAMES = {
+    'ExposureBiasValue': 'EV',
+    'ExposureTime': 'Exposure Time',
+    'MeteringMode': 'Metering Mode',
+    'FocalLength' : 'Focal Length',
+    'FNumber'     : 'Aperture',
+    'ExposureProgram': 'Program',
+    'ISOSpeedRatings': 'ISO',
+    'ExposureMode': 'Exposure Mode',
+    'LensModel': 'Lens',
+}
+
+# The subset of the TAGS dictionary containing the items we're interested
+# in, plus wanted items that are not in the Exif tags dictionary
+EXIF_TAGS = {key: EXIF_NAMES[name] for key, name in ExifTags.TAGS.items() if name in EXIF_NAMES}
+EXIF_TAGS[37510] = 'User Comment'
+
+METERING_MODES = {
+    0 : 'Unknown',
+    1 : 'Average',
+    2 : 'CenterWeightedAverage',
+    3 : 'Spot',
+    4 : 'MultiSpot',
+    5 : 'Pattern',
+    6 : 'Partial',
+    255 : 'other',
+}
+
+EXPOSURE_PROGRAMS = {
+    0 : 'Not defined',
+    1 : 'Manual',
+    2 : 'Normal',
+    3 : 'Aperture',
+    4 : 'Shutter',
+    5 : 'Creative',
+    6 : 'Action',
+    7 : 'Portrait',
+    8 : 'Landscape',
+}
+
+EXPOSURE_MODES = {
+    0 : 'Auto',
+    1 : 'Manual',
+    2 : 'Auto bracket',
+}
+
+# Codecs for UTF-16 text in EXIF data by the byte order of the EXIF block
+UTF16_CODECS = {
+    '>' : 'utf-16be',
+    '<' : 'utf-16le',
+}
 
 debugging = False
 def debug(record):
@@ -32,19 +101,118 @@ def debug(record):
         print(record)
 
 
-def treewalk(rootpath: str, wanted_types: List[str]) -> List[str]:
-    def wanted(p: str):
-        return any([p.endswith(suffix) for suffix in wanted_types])
-
+def split_rational(numerator: int, denominator: int):
+    '''
+    Reduce a fraction to its lowest terms and split it into a sign, a
+    whole number and a proper fraction using integer arithmetic only.
+    Returns (negative, whole, remainder, denominator) where the magnitude
+    is whole + remainder/denominator. The denominator must not be zero
+    '''
+    common = math.gcd(numerator, denominator)
+    n, d = numerator // common, denominator // common
+    if d < 0: n, d = -n, -d
+    whole, remainder = divmod(abs(n), d)
+    return n < 0, whole, remainder, d
+
+
+def treewalk(rootpath: str, wanted_types: List[str], mtimes: Dict[str, int]) -> List[str]:
+    '''
+    Return the paths of the files under rootpath with one of the wanted
+    suffixes. The modification time of each folder is recorded in mtimes
+    before it is read so the caller can tell if anything may have changed
+    '''
+
+    # endswith checks a tuple of suffixes in one call. Ignore case as the
+    # scan of a single folder does
+    suffixes = tuple(wanted_types)
+
+    def scan(folder: str):
+        '''Return the mtime, subfolders and wanted files of one folder'''
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+            subfolders: List[str] = []
+            files: List[str] = []
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    # Like os.walk, don't follow links to directories
+                    if entry.is_dir(follow_symlinks=False):
+                        subfolders.append(entry.path)
+                    elif entry.name.lower().endswith(suffixes) and entry.is_file():
+                        files.append(entry.path)
+            return mtime, subfolders, files
+        except OSError:
+            # Also like os.walk, ignore folders we can't read
+            return None
+
+    # Reading a folder is mostly waiting for the filesystem so read all
+    # the folders at each level of the tree at once
     result: List[str] = []
-    for root, dirs, files in os.walk(rootpath):
-        wanted_files: List[str] = [file for file in files if wanted(file)]
-        wanted_paths: List[str] = [os.path.join(root, file) for file in wanted_files]
-        result.extend(wanted_paths)
+    folders: List[str] = [rootpath]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=TREEWALK_THREADS) as pool:
+        while folders:
+            subfolders: List[str] = []
+            for folder, found in zip(folders, pool.map(scan, folders)):
+                if found is None: continue
+                mtimes[folder], more_folders, files = found
+                subfolders.extend(more_folders)
+                result.extend(files)
+            folders = subfolders
 
     return result
 
 
+def decode_image(path: str, width: int, height: int):
+    '''
+    Load the image at path and scale it to fit within width x height.
+    This doesn't touch Tk so can be run on a worker thread. Returns the
+    scaled image and the size of the original
+    '''
+    pil_image = Image.open(path, 'r')
+
+    # The size as stored, before we ask for a reduced decode, and
+    # whether the camera was turned so that it will be transposed
+    imgWidth, imgHeight = pil_image.size
+    orientation = pil_image.getexif().get(0x0112, 1)
+    if orientation in (5, 6, 7, 8):
+        imgWidth, imgHeight = imgHeight, imgWidth
+
+    # A JPEG can be decoded at 1/2, 1/4 or 1/8 scale which is much
+    # quicker than decoding every pixel only for the resize to throw
+    # most of them away. The decoded image is never smaller than the
+    # size we ask for
+    if pil_image.format == 'JPEG':
+        pil_image.draft('RGB', (width, height))
+    pil_image.load()
+
+    # Most cameras write images the right way up so only transpose when
+    # we need to
+    if orientation != 1:
+        ImageOps.exif_transpose(pil_image, in_place=True)
+
+    # draft() only gives us RGB for YCbCr JPEGs. Anything else, such as
+    # a CMYK JPEG from a print workflow, would be resized with four
+    # channels and converted again by PhotoImage, so convert it once now
+    if pil_image.mode not in ('RGB', 'L'):
+        pil_image = pil_image.convert('RGB')
+
+    # Scale the image to fit the screen - the dimension that
+    # needs scaling most gives us the scale factor to use.
+    decodedWidth, decodedHeight = pil_image.size
+    w_scale = decodedWidth / width
+    h_scale = decodedHeight / height
+    scale = max(w_scale, h_scale)
+    new_size = (int(decodedWidth/scale), int(decodedHeight/scale))
+
+    # Ask for bilinear resampling explicitly - it is cheaper than the
+    # bicubic default and is one of the convolution filters Pillow-SIMD
+    # vectorises. When shrinking a lot, the reducing gap lets Pillow do
+    # most of the work with a quick integer reduce first, leaving the
+    # filter to work on a much smaller image
+    pil_image = pil_image.resize(new_size, Image.BILINEAR, reducing_gap=2.0)
+
+    return pil_image, (imgWidth, imgHeight)
+
+
 class Viewer():
 
     def __init__(self, master, width=None, height=None, bare=False, bell=False, sort=False, randomise=False, treewalk=False, filter=None, path=None):
@@ -53,12 +221,19 @@ class Viewer():
         self.images = []             # The paths of images we know about
         self.skiplist = []           # Corrupt or missing images
 
+        # The same paths as sets so we can quickly tell if we know them
+        self.image_set = set()
+        self.skip_set = set()
+
         self.master = master
         self.rescan = False          # Updater is to start from scratch
+        self.scanned = {}            # Modification times of folders last scanned
+        self.scan_time = 0           # Time in ns when the last scan started
 
         self.slideshow = False                      # Is the slideshow active?
         self.slideshow_ticks = 40                   # Ticks per image 40=10s
-        self.slideshow_next = self.slideshow_ticks  # Ticks left for this image
+        self.slideshow_timer = None                 # Pending move to the next image
+        self.slideshow_deadline = 0.0               # Monotonic time of that move
 
         self.show_histogram = False  # Don't display the histogram yet
         self.bell = bell             # Don't ring the bell when new images appear
@@ -68,6 +243,8 @@ class Viewer():
         self.update = True           # Update current image when one arrives
         self.info = False            # Don't display info from Exif and current status
         self.path = path
+        self.metadata_changed = False  # Ratings or notes not yet saved
+        self.metadata_flush = None     # Pending call to save them
         self.load_metadata()
         self.filter = filter
         self.treewalk = treewalk
@@ -113,7 +290,22 @@ class Viewer():
         self.image_widget = tkinter.Canvas(master, width=self.main_w, height=self.main_h)
         self.image_widget.pack()
         self.image_widget.configure(bd=0, background=BGCOLOUR)
-        self.canvas_image = None
+
+        # The image, the histogram and the EXIF text are canvas items we
+        # create once and then update rather than recreate
+        self.canvas_image = self.image_widget.create_image(0, 0, anchor='nw')
+        self.current_image = None    # Photo image shown by canvas_image
+        self.current_format = None   # Mode and size of the photo image
+        self.histogram_items = None
+        self.histogram_timer = None  # Pending draw of the histogram
+        self.exif_text = None        # Text shown in the EXIF item
+
+        # Images are decoded and scaled on a worker thread so that the
+        # display stays responsive
+        self.decoder = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self.decoding = None         # Future for the image being loaded
+        self.decoded = collections.OrderedDict()  # Modification time and future for recent images by path
+        self.exif_cache = collections.OrderedDict()  # Modification time and EXIF info by path
         debug('Viewer constructed')
 
     def goto_image(self, index, delta=1):
@@ -143,6 +335,9 @@ class Viewer():
         '''
         debug('on_clearskip')
         self.skiplist = []
+        self.skip_set = set()
+        self.scanned = {}
+        self.exif_cache.clear()
 
     def on_centre(self, _):
         '''
@@ -150,11 +345,14 @@ class Viewer():
         '''
         debug('on_centre')
         self.centre_image = not self.centre_image
-        self.load_image()
+
+        # The image on display doesn't change, it just moves
+        self.place_image()
 
     def on_escape(self, event):
         '''Quit the application'''
         debug('escape')
+        self.decoder.shutdown(wait=False, cancel_futures=True)
         event.widget.withdraw()
         event.widget.quit()
 
@@ -183,19 +381,51 @@ class Viewer():
         '''Toggle slideshow'''
         self.slideshow = not self.slideshow
         debug(f'space {self.slideshow}')
+        self.schedule_slideshow()
 
     def on_plus(self, _):
         '''Double speed of slideshow and step on to the next.'''
         if self.slideshow_ticks >= 2:
             self.slideshow_ticks //= 2
         debug(f'plus {self.slideshow_ticks}')
-        self.slideshow_next = 1
+        self.schedule_slideshow(1)
 
     def on_minus(self, _):
         '''Halve the speed of the slideshow'''
         self.slideshow_ticks *= 2
         debug(f'minus {self.slideshow_ticks}')
 
+    def schedule_slideshow(self, ticks=None):
+        '''
+        Move on to the next image after the given number of ticks, or a
+        full image's worth, replacing any move already pending. There is
+        a single timer per image rather than a count kept by the updater
+        '''
+        if self.slideshow_timer is not None:
+            self.master.after_cancel(self.slideshow_timer)
+            self.slideshow_timer = None
+        if self.slideshow:
+            if ticks is None: ticks = self.slideshow_ticks
+            self.slideshow_deadline = time.monotonic() + ticks * SLIDESHOW_TICK / 1000
+            self.slideshow_timer = self.master.after(ticks * SLIDESHOW_TICK, self.on_slideshow)
+
+    def on_slideshow(self):
+        '''The slideshow timer has expired so show the next image'''
+        self.slideshow_timer = None
+        self.on_right(None)
+
+        # Time the next move from when this one was due rather than when
+        # the timer got to run, so a busy moment doesn't slow the pace.
+        # If we've fallen a whole image behind, start afresh from now
+        # rather than rushing through the next few to catch up
+        now = time.monotonic()
+        interval = self.slideshow_ticks * SLIDESHOW_TICK / 1000
+        self.slideshow_deadline += interval
+        if self.slideshow_deadline <= now:
+            self.slideshow_deadline = now + interval
+        delay = round((self.slideshow_deadline - now) * 1000)
+        self.slideshow_timer = self.master.after(delay, self.on_slideshow)
+
     def on_rating(self, info):
         current_image_name = os.path.basename(self.images[self.image_index])
         if current_image_name not in self.metadata:
@@ -255,126 +485,108 @@ class Viewer():
         self.show_histogram = not self.show_histogram
         debug(f'histogram {self.show_histogram}')
         if not self.show_histogram:
-            # Undraw the histogram by deleting it from the canvas display file
-            self.image_widget.delete('exposure')
+            # Undraw the histogram and EXIF text by hiding them, making sure
+            # a pending draw doesn't bring them back
+            self.cancel_histogram()
+            self.image_widget.itemconfigure('exposure', state='hidden')
         else:
             # Draw the histogram by redoing it all, which is a little slow
             self.goto_image(self.image_index)
 
-    def get_exif_info(self, pil_image):
+    def get_exif_info(self, pil_image, path):
+        '''
+        Return the interesting EXIF information for the image at path,
+        reusing what we found last time it was shown if the file hasn't
+        changed since. The caller is free to modify the dictionary.
+        '''
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return self.read_exif_info(pil_image)
+
+        cached = self.exif_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            self.exif_cache.move_to_end(path)
+            return dict(cached[1])
+
+        result = self.read_exif_info(pil_image)
+        self.exif_cache[path] = (mtime, result)
+        self.exif_cache.move_to_end(path)
+        while len(self.exif_cache) > EXIF_CACHE:
+            self.exif_cache.popitem(last=False)
+        return dict(result)
+
+    def read_exif_info(self, pil_image):
         '''
         Return a dictionary containing all the interesting information
         where the keys are the user-friendly labels. If there is no
         EXIF info of interest, the dictionary will be empty.
         '''
 
-        # This provides baseline information only
+        # This provides baseline information only, of which we only want
+        # the camera model (tag 0x0110)
         exif_data = pil_image.getexif()
-        result = {ExifTags.TAGS[key]: value for key, value in exif_data.items() if key in ExifTags.TAGS and ExifTags.TAGS[key] in ('Model',)}
-
-        # The interesting stuff is in the Private TIFF tag IFD with the tag ExifIFD=0x8769
+        if not exif_data: return {}
+        model = exif_data.get(0x0110)
+        result = {'Model': model} if model is not None else {}
+
+        # The interesting stuff is in the Private TIFF tag IFD with the tag
+        # ExifIFD=0x8769. Screenshots and the like often have no such IFD
+        # and there is nothing more to do
+        if 0x8769 not in exif_data: return result
         ifd_data = exif_data.get_ifd(0x8769)
+        if not ifd_data: return result
 
-        # Create a subset of the TAGS dictionary containing the items we're
-        # interested in
-        public_name = {
-            'ExposureBiasValue': 'EV',
-            'ExposureTime': 'Exposure Time',
-            'MeteringMode': 'Metering Mode',
-            'FocalLength' : 'Focal Length',
-            'FNumber'     : 'Aperture',
-            'ExposureProgram': 'Program',
-            'ISOSpeedRatings': 'ISO',
-            'ExposureMode': 'Exposure Mode',
-            'LensModel': 'Lens',
-        }
-
-        wanted_tags = {key: public_name[name] for key, name in ExifTags.TAGS.items() if name in (
-            'ExposureBiasValue',
-            'ExposureTime',
-            'MeteringMode',
-            'FocalLength',
-            'FNumber',
-            'ExposureProgram',
-            'ISOSpeedRatings',
-            'ExposureMode',
-            'LensModel',
-        )}
-
-        # Add wanted items that are not in the Exif tags dictionary
-        wanted_tags[37510] = 'User Comment'
-
-        # For every tag in the ifd data which is in our TAGS dictionary,
-        # place it's name and value in our results
-        ifd_tags = {wanted_tags[tag]: value for tag, value in ifd_data.items() if tag in wanted_tags}
-
-        result.update(ifd_tags)
+        # Look up each of the tags we want rather than going through
+        # everything in the IFD, placing its name and value in our results
+        for tag, name in EXIF_TAGS.items():
+            value = ifd_data.get(tag)
+            if value is not None:
+                result[name] = value
 
         # Fix up some values to make them more familiar
         if 'Exposure Time' in result:
+            # Compare the numerator and denominator as integers rather
+            # than comparing the rational with 1
             rational = result['Exposure Time']
-            if rational < 1:
+            n, d = rational.numerator, rational.denominator
+            if 0 < d and n < d:
                 # Not necessarily in lowest terms
-                # Not necessarily in lowest terms
-                fraction = fractions.Fraction(rational.numerator, rational.denominator)
-                result['Exposure Time'] = f'{fraction.numerator}/{fraction.denominator} sec'
+                common = math.gcd(n, d)
+                result['Exposure Time'] = f'{n//common}/{d//common} sec'
             else:
                 result['Exposure Time'] = f'{rational} sec'
 
         if 'EV' in result:
-            rational = result['EV']
-            sign = '+' if rational >= 0 else '-'
-            if sign == '-': rational = -rational
-            whole = int(rational)
-            fraction = rational - whole
-            if fraction.numerator != 0:
-                result['EV'] = f'{sign}{whole if whole != 0 else ""} {fraction.numerator}/{fraction.denominator}'
-            else:
-                result['EV'] = f'{sign}{whole}'
-
+            # A zero denominator means the value is unknown
+            n, d = result['EV'].numerator, result['EV'].denominator
+            if d != 0:
+                negative, whole, remainder, d = split_rational(n, d)
+                sign = '-' if negative else '+'
+                if remainder != 0:
+                    result['EV'] = f'{sign}{whole if whole != 0 else ""} {remainder}/{d}'
+                else:
+                    result['EV'] = f'{sign}{whole}'
+
+        # The g format drops the point from whole numbers, so f/4 rather
+        # than f/4.0
         if 'Focal Length' in result:
-            result['Focal Length'] = f'{result["Focal Length"]}mm'
+            result['Focal Length'] = f'{float(result["Focal Length"]):g}mm'
 
         if 'Aperture' in result:
-            aperture = f'f/{result["Aperture"]}'
-            if aperture.endswith('.0'): aperture = aperture[:-2]
-            result['Aperture'] = aperture
+            result['Aperture'] = f'f/{float(result["Aperture"]):g}'
 
         if 'ISO' in result:
             result['ISO'] = f'{result["ISO"]}'
 
         if 'Metering Mode' in result:
-            result['Metering Mode'] = {
-                0 : 'Unknown',
-                1 : 'Average',
-                2 : 'CenterWeightedAverage',
-                3 : 'Spot',
-                4 : 'MultiSpot',
-                5 : 'Pattern',
-                6 : 'Partial',
-                255 : 'other',
-            }.get(result['Metering Mode'], 'Undefined')
+            result['Metering Mode'] = METERING_MODES.get(result['Metering Mode'], 'Undefined')
 
         if 'Program' in result:
-            result['Program'] = {
-            0 : 'Not defined',
-                1 : 'Manual',
-                2 : 'Normal',
-                3 : 'Aperture',
-                4 : 'Shutter',
-                5 : 'Creative',
-                6 : 'Action',
-                7 : 'Portrait',
-                8 : 'Landscape'
-
-            }.get(result['Program'], 'Undefined')
+            result['Program'] = EXPOSURE_PROGRAMS.get(result['Program'], 'Undefined')
 
         if 'Exposure Mode' in result:
-            result['Exposure Mode'] = {
-                0 : 'Auto',
-                1 : 'Manual',
-                2 : 'Auto bracket'
-            }.get(result['Exposure Mode'], 'Undefined')
+            result['Exposure Mode'] = EXPOSURE_MODES.get(result['Exposure Mode'], 'Undefined')
 
         # If there is a TIFF UserComment attribute (37510), decode it
         if 'User Comment' in result:
@@ -386,8 +598,7 @@ class Viewer():
             debug(f'user comment detected with encoding {encoding}')
             if encoding == b'UNICODE\x00':
                 # We need the endianness :
-                utf16_order = 'utf-16be' if exif_data.endian == '>' else 'utf-16le'
-                decoded_data = data.decode(utf16_order)
+                decoded_data = data.decode(UTF16_CODECS.get(exif_data.endian, 'utf-16le'))
                 result['User Comment'] = decoded_data
             else:
                 # Assume this is ascii
@@ -395,53 +606,81 @@ class Viewer():
         return result
 
 
+    def cancel_histogram(self):
+        '''Abandon any draw of the histogram that is still waiting'''
+        if self.histogram_timer is not None:
+            self.master.after_cancel(self.histogram_timer)
+            self.histogram_timer = None
+
+    def on_histogram_timer(self, pil_image, image_path):
+        '''The image has been shown long enough to draw its histogram'''
+        self.histogram_timer = None
+        self.draw_histogram(pil_image, image_path)
+
     def draw_histogram(self, pil_image, image_path):
         '''Given a PIL image, render the histogram for it'''
 
-        # We need a greyscale version which has 256 values
-        mono = pil_image.convert('L')
+        # We need a greyscale version which has 256 values. Every fourth
+        # pixel in each direction gives the same shape for a sixteenth of
+        # the work. Greyscale images already are, so don't convert them
+        width, height = pil_image.size
+        sample = pil_image.resize((max(1, width//HISTOGRAM_STEP), max(1, height//HISTOGRAM_STEP)), Image.NEAREST)
+        mono = sample if sample.mode == 'L' else sample.convert('L')
         histogram = mono.histogram()
 
         # Fix the histogram size at 256 pixels wide (one per luminosity value)
         # and a third as high. and position it at the top right of the canvas
         # with a margin of 10 pixels above and to the right.
         NUMLEVELS = 256
-        BINWIDTH = 1
         MAXH = 256 // 2
         MARGIN = 10
         origin_x = self.main_w - MARGIN - NUMLEVELS
         origin_y = 0 + MARGIN + MAXH
 
-        # Allow for some smoothing of data by averaging adjacent samples
-        if BINWIDTH > 1:
-            # We need to reduce the histogram size
-            for b in range(len(histogram) / BINWIDTH):
-                bins = range(BINWIDTH*b, BINWIDTH*(b+1))
-                bin_mean = sum([histogram[x] for x in bins]) / BINWIDTH
-                for bin in bins:
-                    histogram[bin] = bin_mean
-
         # Stop a few huge intensities dwarfing the others by clipping
         # at an intensity that exceeds 97.5% of the histogram values.
         # If the image is practially all black, the last quantile may
         # be very small or even zero - use 10 as a minimum.
-        clip = max(10, statistics.quantiles(histogram, n=25)[-1])
-
-        # We need to scale the brightness into the range 0..MAXH
+        # This is the last of the 25-quantiles of the counts, interpolated
+        # between the neighbouring ranks as statistics.quantiles does.
+        # Those ranks are among the largest few counts so just pick those
+        # out rather than sorting them all
+        position = (len(histogram) + 1) * 24 / 25
+        rank = int(position)
+        largest = heapq.nlargest(len(histogram) - rank + 1, histogram)
+        below, above = largest[-1], largest[-2]
+        clip = max(10, below + (above - below) * (position - rank))
+
+        # We need to scale the brightness into the range 0..MAXH. Tk takes
+        # the vertices as one flat list of coordinates, so build that
+        # directly rather than a list of pairs for tkinter to flatten
         debug(f'histogram clip={clip} total={sum(histogram)}')
         scale = MAXH / clip
-        polygon = [(origin_x + x, origin_y - scale*min(clip,histogram[x])) for x in range(NUMLEVELS)]
-
-        # Delete the old histogram if there was one
-        self.image_widget.delete('exposure')
-
-        # Draw the new one and keep track of the canvas display file ids
-        self.image_widget.create_rectangle(origin_x, origin_y, origin_x+NUMLEVELS, origin_y-MAXH, fill='#202020', outline='', tags='exposure')
-        self.image_widget.create_polygon((origin_x, origin_y), *polygon, (origin_x+NUMLEVELS, origin_y), fill='white', tags='exposure')
+        polygon = [origin_x, origin_y]
+        for x, count in enumerate(histogram):
+            polygon.append(origin_x + x)
+            polygon.append(origin_y - scale*min(clip, count))
+        polygon.append(origin_x + NUMLEVELS)
+        polygon.append(origin_y)
+
+        # Draw the histogram the first time and keep track of the canvas
+        # display file ids. After that, just reshape it. The EXIF text and
+        # the rectangle behind it are created here too and filled in below
+        if self.histogram_items is None:
+            self.histogram_items = (
+                self.image_widget.create_rectangle(origin_x, origin_y, origin_x+NUMLEVELS, origin_y-MAXH, fill='#202020', outline='', tags='exposure'),
+                self.image_widget.create_polygon(polygon, fill='white', tags='exposure'),
+                self.image_widget.create_rectangle(0, 0, 0, 0, fill=BGCOLOUR, outline=BGCOLOUR, tags='exposure'),
+                self.image_widget.create_text(origin_x+256, origin_y+20, fill='white', anchor='ne', font=('Consolas', 10), tags='exposure'),
+            )
+        else:
+            self.image_widget.coords(self.histogram_items[1], polygon)
+            self.image_widget.itemconfigure('exposure', state='normal')
+        _, _, rect_id, text_id = self.histogram_items
 
         # Now add EXIF info if there is any. We cheat a bit here and add our own
         # rating and notes as EXIF tags
-        exif_info = self.get_exif_info(pil_image)
+        exif_info = self.get_exif_info(pil_image, image_path)
         image_name = os.path.basename(image_path)
         metadata = self.metadata.get(image_name, {'rating': '0', 'notes': ''})
         rating = metadata['rating']
@@ -453,56 +692,133 @@ class Viewer():
         exif_info['Name'] = os.path.basename(image_path)
         exif_info['Time'] = f'{datetime.datetime.now():%H:%M:%S}'
 
+        text = ''
         if len(exif_info) > 0:
 
-            # Treat some items specially - mainly to keep the width down
-            text = ''
+            # Treat some items specially - mainly to keep the width down. We
+            # collect the lines of text and join them once at the end
+            lines = []
             longest = 0
             if 'Model' in exif_info:
-                text += exif_info['Model'] + '\n'
+                lines.append(exif_info['Model'])
                 longest = max (longest, len(exif_info['Model']))
                 del exif_info['Model']
             if 'Lens' in exif_info:
-                text += exif_info['Lens'] + '\n'
+                lines.append(exif_info['Lens'])
                 longest = max(longest, len(exif_info['Lens']))
                 del exif_info['Lens']
             if 'Aperture' in exif_info and 'Exposure Time' in exif_info and 'ISO' in exif_info:
-                text += f'{exif_info["Exposure Time"]} at {exif_info["Aperture"]}, ISO {exif_info["ISO"]}\n'
+                lines.append(f'{exif_info["Exposure Time"]} at {exif_info["Aperture"]}, ISO {exif_info["ISO"]}')
 
+            # The comment will be long so wrap it into multiple lines. If
+            # there isn't one to show we leave a blank line instead
+            comments = []
             if 'User Comment' in exif_info:
                 if self.info:
-                    # The comment will be long so wrap it into multiple lines
                     comments = textwrap.wrap(exif_info['User Comment'], 60)
-                    text += '\n'.join(comments)
                 del exif_info['User Comment']
-
-
-            text += '\n'
+            lines.append('\n'.join(comments))
 
             # The width of the longest remaining label so we can pad them
             # to this width
-            max_label_width = max([len(label) for label in exif_info], default=longest) + 1
-            text += '\n'.join([f'{label+":":{max_label_width}} {value}' for label, value in exif_info.items()])
-            text_id = self.image_widget.create_text(origin_x+256, origin_y+20, text=text, fill='white', anchor='ne', font=('Consolas', 10), tags='exposure')
+            max_label_width = max(map(len, exif_info), default=longest) + 1
+            lines.extend([f'{(label+":").ljust(max_label_width)} {value}' for label, value in exif_info.items()])
+            text = '\n'.join(lines)
 
-            # In case the text overlaps the image and the image is the same
-            # colour as the text, we'll get the extent of the text and draw
-            # a grey rectangle behind it
-            extent = self.image_widget.bbox(text_id)
-            rect_id = self.image_widget.create_rectangle(*extent, fill=BGCOLOUR, outline=BGCOLOUR, tags='exposure')
-            self.image_widget.tag_raise(text_id, rect_id)
+        # In case the text overlaps the image and the image is the same
+        # colour as the text, there is a grey rectangle behind it. Finding
+        # the extent of the text makes Tk lay it out so only do that when
+        # the text has changed
+        if text != self.exif_text:
+            self.exif_text = text
+            self.image_widget.itemconfigure(text_id, text=text)
+            extent = self.image_widget.bbox(text_id) if text else None
+            self.image_widget.coords(rect_id, *(extent or (0, 0, 0, 0)))
 
 
     def load_image(self):
-        '''Load the image with the current image index'''
+        '''
+        Start loading the image with the current image index. The decode
+        runs on a worker thread and finish_load displays the result
+        '''
         if self.image_index == None: return
 
-        # Get PIL to load the image
         path = self.images[self.image_index]
+        previous = self.decoding
+        self.decoding = self.decode(path)
+
+        # Abandon the image we were waiting for if it hasn't started so that
+        # holding down an arrow key doesn't queue up decodes. Should it be
+        # wanted again, decode will start it afresh
+        if previous is not None and previous is not self.decoding:
+            previous.cancel()
+
+        self.master.after(DECODE_POLL, self.finish_load, self.decoding, path)
+
+    def decode(self, path):
+        '''
+        Return the future for the decoded image at path, starting the
+        decode if we don't already have it. We keep the most recently
+        used few so that going back and forth is instant. If the file has
+        been rewritten since we decoded it, decode it again
+        '''
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            # Let the decode report the problem
+            mtime = None
+
+        cached = self.decoded.get(path)
+        if cached is not None and cached[0] == mtime and not cached[1].cancelled():
+            decoding = cached[1]
+        else:
+            if cached is not None: cached[1].cancel()
+            decoding = self.decoder.submit(decode_image, path, self.main_w, self.main_h)
+            self.decoded[path] = (mtime, decoding)
+        self.decoded.move_to_end(path)
+
+        # Forget the oldest, abandoning any that haven't started yet, until
+        # we're within both the number of images and the memory we allow.
+        # The one just asked for is always kept
+        while len(self.decoded) > 1 and (len(self.decoded) > DECODE_CACHE or self.decoded_bytes() > DECODE_BUDGET):
+            _, (_, oldest) = self.decoded.popitem(last=False)
+            oldest.cancel()
+
+        return decoding
+
+    def decoded_bytes(self):
+        '''
+        The memory taken by the images that have been decoded so far. A
+        large screen makes each one bigger so we can keep fewer of them
+        '''
+        total = 0
+        for _, decoding in self.decoded.values():
+            if decoding.done() and not decoding.cancelled() and decoding.exception() is None:
+                pil_image, _ = decoding.result()
+                total += pil_image.width * pil_image.height * len(pil_image.getbands())
+        return total
+
+    def finish_load(self, decoding, path):
+        '''
+        Display the image when the worker has finished decoding it. This
+        runs on the Tk thread as Tk must only be used from there
+        '''
+
+        # Ignore the result if another image has been asked for since
+        if decoding is not self.decoding: return
+
+        if not decoding.done():
+            self.master.after(DECODE_POLL, self.finish_load, decoding, path)
+            return
+
+        # It may have been pushed out of the cache before it started
+        if decoding.cancelled():
+            self.load_image()
+            return
+
+        self.decoding = None
         try:
-            pil_image = Image.open(path, 'r')
-            pil_image.load()
-            ImageOps.exif_transpose(pil_image, in_place=True)
+            pil_image, (imgWidth, imgHeight) = decoding.result()
 
         except (PIL.UnidentifiedImageError, FileNotFoundError, OSError) as e:
             #if isinstance(e, FileNotFoundError):
@@ -511,42 +827,67 @@ class Viewer():
             #else:
             #    print(f'unable to load image {path} - skipping', file=sys.stderr)
             print(f'warning: skipping {path} - {e}', file=sys.stderr)
+            self.decoded.pop(path, None)
+            self.exif_cache.pop(path, None)
             self.skiplist.append(path)
-            del self.images[self.image_index]
+            self.skip_set.add(path)
+
+            # Drop it from the list, unless a rescan has done so already,
+            # and show whatever is now in its place. That may be the first
+            # image if this was the last one, or nothing if none are left
+            if path in self.image_set:
+                index = self.images.index(path)
+                del self.images[index]
+                self.image_set.discard(path)
+                if self.image_index is not None and index < self.image_index:
+                    self.image_index -= 1
+            if not self.images:
+                self.image_index = None
+            elif self.image_index is not None:
+                self.image_index %= len(self.images)
 
             self.load_image()
             return
 
-
-        imgWidth, imgHeight = pil_image.size
         self.master.title(f'Image Viewer - {imgWidth}x{imgHeight} - {path}')
 
-        # Scale the image to fit the screen - the dimension that
-        # needs scaling most gives us the scale factor to use.
-        w_scale = imgWidth / self.main_w
-        h_scale = imgHeight / self.main_h
-        scale = max(w_scale, h_scale)
-        new_size = (int(imgWidth/scale), int(imgHeight/scale))
-
-        # This is the first operation on the file and so the point at which
-        # a corrupt image will be detected
-        pil_image = pil_image.resize(new_size)
-
         # We need to keep a reference to the photo image alive to
-        # prevent it being garbage collected
-        self.current_image = ImageTk.PhotoImage(pil_image)
-        if self.canvas_image != None:
-            self.image_widget.delete(self.canvas_image)
-        if self.centre_image:
-            self.canvas_image = self.image_widget.create_image(self.main_w/2, self.main_h/2, anchor='center', image=self.current_image)
+        # prevent it being garbage collected. Images from the same camera
+        # are usually the same size once scaled, so copy the pixels into
+        # the one we have rather than making a new one if we can
+        format = (pil_image.mode, pil_image.size)
+        if format == self.current_format:
+            self.current_image.paste(pil_image)
         else:
-            self.canvas_image = self.image_widget.create_image(0, 0, anchor='nw', image=self.current_image)
+            self.current_image = ImageTk.PhotoImage(pil_image)
+            self.current_format = format
+            self.image_widget.itemconfigure(self.canvas_image, image=self.current_image)
+        self.place_image()
 
-        debug(f'loaded {self.image_index}={self.images[self.image_index]}')
+        debug(f'loaded {self.image_index}={path}')
 
+        # Only draw the histogram once we've stayed on the image for a
+        # moment so that stepping quickly through images isn't held up.
+        # Until then, hide the one for the previous image so that it isn't
+        # shown describing this one
         if self.show_histogram:
-            self.draw_histogram(pil_image, path)
+            self.cancel_histogram()
+            self.image_widget.itemconfigure('exposure', state='hidden')
+            self.histogram_timer = self.master.after(HISTOGRAM_DELAY, self.on_histogram_timer, pil_image, path)
 
+        # Get the neighbours ready in case they're wanted next
+        for step in (1, -1, 2):
+            self.decode(self.images[(self.image_index + step) % len(self.images)])
+
+
+    def place_image(self):
+        '''Move the image to the centre or the top left of the canvas'''
+        if self.centre_image:
+            self.image_widget.coords(self.canvas_image, self.main_w/2, self.main_h/2)
+            self.image_widget.itemconfigure(self.canvas_image, anchor='center')
+        else:
+            self.image_widget.coords(self.canvas_image, 0, 0)
+            self.image_widget.itemconfigure(self.canvas_image, anchor='nw')
 
     def updater(self):
         '''Called regularly to see if new images have appeared on disk'''
@@ -557,49 +898,101 @@ class Viewer():
             debug('rescan')
             # We've been asked to rescan the directory - perhaps a file disappeared
             self.images = []
+            self.image_set = set()
             self.image_index = None
             self.rescan = False
-
-        # All of the files in the hot directory that end in .jpg
-        if self.treewalk:
-            paths = treewalk(self.path, ['.jpeg', '.jpg'])
+            self.scanned = {}
+
+        # All of the files in the hot directory that end in .jpg. Nothing
+        # can have appeared unless a folder we read last time has been
+        # modified since, so most of the time we needn't look
+        if self.folders_changed():
+            self.scanned = {}
+            self.scan_time = time.time_ns()
+            if self.treewalk:
+                paths = treewalk(self.path, ['.jpeg', '.jpg'], self.scanned)
+            else:
+                # Simple way to collect our images. The directory entries
+                # know whether they are files so no further stat is needed
+                self.scanned[self.path] = os.stat(self.path).st_mtime_ns
+                with os.scandir(self.path) as entries:
+                    paths = [entry.path for entry in entries if entry.name.lower().endswith(('.jpg', '.jpeg')) and entry.is_file()]
         else:
-            # Simple way to collect our images
-            paths = [os.path.join(self.path, file) for file in os.listdir(self.path) if file.lower().endswith('.jpg') or file.lower().endswith('.jpeg')]
+            paths = []
 
         # Images that have appeared since we last looked, ignoring the corrupt
         # ones we already know about
-        new_images = [path for path in paths if path not in self.images and path not in self.skiplist and os.path.isfile(path)]
+        new_images = [path for path in paths if path not in self.image_set and path not in self.skip_set]
+
+        # The camera or a copy may still be writing an image that has only
+        # just appeared. Rather than fail to decode part of a file and skip
+        # it for good, leave any that changed in the last SETTLE_TIME
+        # seconds for a later scan. Writing to a file doesn't change its
+        # folder, so make sure that scan happens
+        if new_images:
+            now = time.time()
+            settled = []
+            for path in new_images:
+                try:
+                    if abs(now - os.stat(path).st_mtime) < SETTLE_TIME:
+                        self.scanned = {}
+                        continue
+                except OSError:
+                    # It has gone again already
+                    continue
+                settled.append(path)
+            new_images = settled
 
         if new_images != []:
 
             # There are new images so whereever we were, move
             # to the first new image and display it
             debug(f'saw {new_images}')
-            random.shuffle(new_images)
-
-            self.image_index = len(self.images)
-            self.images.extend(new_images)
             if self.sort_on_load:
-                self.images.sort()
+                # Keep the list sorted by putting each new image in its
+                # place rather than sorting the whole collection again
+                new_images.sort()
+                if not self.images or new_images[0] > self.images[-1]:
+                    self.images.extend(new_images)
+                else:
+                    for path in new_images:
+                        bisect.insort(self.images, path)
+                self.image_index = bisect.bisect_left(self.images, new_images[0])
+            else:
+                if self.randomise_on_load:
+                    random.shuffle(new_images)
+                self.image_index = len(self.images)
+                self.images.extend(new_images)
+            self.image_set.update(new_images)
             self.load_image()
 
-            # Reset the slideshow
+            # Stop the slideshow
             self.slideshow = False
-            self.slideshow_next = self.slideshow_ticks
+            self.schedule_slideshow()
 
             if self.bell:
                 self.master.bell()
 
-        if self.slideshow:
-            self.slideshow_next -= 1
-            if self.slideshow_next == 0:
-                self.slideshow_next = self.slideshow_ticks
-                self.on_right(None)
-
         '''We want to be called again'''
         self.master.after(250, self.updater)
 
+    def folders_changed(self):
+        '''
+        Has any folder we read in the last scan been modified since? If
+        not, no new image can have appeared in it.
+
+        A file added soon after a folder was modified may leave its mtime
+        unchanged as filesystems only keep it to some granularity. So we
+        also treat a folder as changed while its mtime is too close to the
+        time of the scan for us to be sure we saw everything
+        '''
+        if not self.scanned: return True
+        recent = self.scan_time - int(MTIME_GRANULE * 1e9)
+        try:
+            return any(mtime >= recent or os.stat(folder).st_mtime_ns != mtime for folder, mtime in self.scanned.items())
+        except OSError:
+            return True
+
     def load_metadata(self):
         '''
         The file 'metadata.csv' in the hot folder, if it exists, holds
@@ -623,21 +1016,32 @@ class Viewer():
                     self.metadata[image]= {'rating': rating, 'notes': notes}
 
     def save_metadata(self):
+        '''
+        Arrange for the updated ratings to be saved shortly. Changes made
+        in quick succession, such as rating a run of images, are written
+        together
+        '''
+        self.metadata_changed = True
+        if self.metadata_flush is None:
+            self.metadata_flush = self.master.after(METADATA_DELAY, self.flush_metadata)
+
+    def flush_metadata(self):
         '''
         Save the updated ratings if there are any.
         '''
+        self.metadata_flush = None
+        if not self.metadata_changed: return
+        self.metadata_changed = False
+
         if len(self.metadata) > 0:
             metadata_db = os.path.join(self.path, 'metadata.csv')
-            with open(metadata_db, 'w', newline='') as db:
-                for image in self.metadata.keys():
+            with open(metadata_db, 'w', newline='', buffering=65536) as db:
 
-                    # Only use base name so we can relocate the data
-                    image = os.path.basename(image)
-                    # We put the rating first in case the notes contains spaces
-                    writer = csv.writer(db)
-                    writer.writerow([image, self.metadata[image]['rating'], self.metadata[image]['notes']])
+                # Only use base name so we can relocate the data. We put the
+                # rating first in case the notes contains spaces
+                rows = [[os.path.basename(image), data['rating'], data['notes']] for image, data in self.metadata.items()]
+                csv.writer(db).writerows(rows)
 
-import sys
 
 if __name__ == '__main__':
 
@@ -678,6 +1082,12 @@ navigation keys:
     args = parser.parse_args()
 
     debugging = args.debug
+
+    # Pillow-SIMD gives its releases a post version number. Say if we're
+    # running with the slower stock Pillow
+    if 'post' not in PIL.__version__:
+        debug(f'Pillow {PIL.__version__} is not Pillow-SIMD - resizing will be slower')
+
     tk = tkinter.Tk()
 
     app = Viewer(master=tk, width=args.width, height=args.height,
@@ -688,4 +1098,7 @@ navigation keys:
     tk.after(10, app.updater)
     tk.mainloop()
 
+    # Make sure the latest ratings are saved however we were closed
+    app.flush_metadata()
+
 